@@ -9,28 +9,143 @@ Author: Development Team
 Project: GenAI Bedrock Microservice
 """
 
+import base64
+import gzip
+import hashlib
 import json
 import logging
 import os
-from typing import Dict, Any, Optional
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError, BotoCoreError
 
-# Configure logging
+# SnapStart runtime hooks are only available on SnapStart-enabled runtimes
+try:
+    from snapshot_restore_py import register_after_restore
+except ImportError:
+    register_after_restore = None
+
+# Prefer orjson for request/response (de)serialization when it is packaged
+try:
+    import orjson
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+# Configure logging, defaulting to WARNING so per-request INFO messages are skipped
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(getattr(logging, os.environ.get('LOG_LEVEL', 'WARNING').upper(), logging.WARNING))
 
-# Initialize Bedrock client
-bedrock_client = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-west-2'))
+# Initialize Bedrock client with a connection pool sized for concurrent calls
+bedrock_config = Config(
+    max_pool_connections=int(os.environ.get('BEDROCK_POOL', 50)),
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    read_timeout=60,
+    connect_timeout=3
+)
+bedrock_client = boto3.client(
+    'bedrock-runtime',
+    region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-west-2'),
+    config=bedrock_config
+)
 
 # Configuration constants
-BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-haiku-20241022-v1:0')
+BEDROCK_MODEL_ID = sys.intern(os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-haiku-20241022-v1:0'))
 MAX_TOKENS = 4000
 TEMPERATURE = 0.7
+MAX_BATCH_PROMPTS = 16
+# Upper bound on the JSON request body. The default fits a full batch of
+# maximum-length prompts where every character is an astral code point sent as
+# a 12-character surrogate-pair escape, plus room for the JSON envelope.
+MAX_BODY_LENGTH = int(os.environ.get('MAX_BODY_LENGTH', MAX_BATCH_PROMPTS * 4000 * 12 + 4096))
+SYSTEM_PROMPT = os.environ.get('SYSTEM_PROMPT', '')
+WARMUP_BEDROCK = os.environ.get('WARMUP_BEDROCK') == '1'
+logger.info("Using Bedrock model: %s", BEDROCK_MODEL_ID)
+
+# In-process response cache, reused across invocations of a warm container
+CACHE_MAX = int(os.environ.get('CACHE_MAX', 1024))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))
+_RESPONSE_CACHE: 'OrderedDict[bytes, tuple]' = OrderedDict()
+
+# Minimum response body size, in bytes, worth gzip-compressing
+COMPRESS_MIN = int(os.environ.get('COMPRESS_MIN', 1024))
+
+# Headers sent with every API Gateway response
+_DEFAULT_HEADERS = MappingProxyType({
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+})
+
+
+# User-facing messages for known Bedrock ClientError codes
+_ERROR_MAP = {
+    'AccessDeniedException': 'Access denied to Bedrock model. Please check IAM permissions.',
+    'ValidationException': 'Invalid request to Bedrock model.',
+    'ThrottlingException': 'Request throttled. Please try again later.'
+}
+
+
+def warm_up_bedrock_connection() -> None:
+    """
+    Open the pooled HTTPS connection to Bedrock before the first user request.
+    
+    Sends an empty InvokeModel request, which Bedrock rejects without running
+    the model, so DNS, TLS and credential resolution happen during init. The
+    request is made once with a short connect timeout and no retries, so an
+    unreachable endpoint cannot push init past Lambda's 10 second limit.
+    """
+    warmup_client = boto3.client(
+        'bedrock-runtime',
+        region_name=bedrock_client.meta.region_name,
+        config=bedrock_config.merge(Config(
+            retries={'total_max_attempts': 1, 'mode': 'standard'},
+            connect_timeout=2
+        ))
+    )
+    # Share the main client's connection pool so requests reuse the warmed connection
+    warmup_client._endpoint.http_session = bedrock_client._endpoint.http_session
+    
+    try:
+        warmup_client.invoke_model(
+            modelId=BEDROCK_MODEL_ID,
+            body=b'{}',
+            contentType='application/json',
+            accept='application/json'
+        )
+    except ClientError:
+        pass
+    except BotoCoreError as e:
+        logger.warning(f"Bedrock warm-up failed: {str(e)}")
+
 
+if WARMUP_BEDROCK:
+    warm_up_bedrock_connection()
+    if register_after_restore is not None:
+        # Connections captured in a SnapStart snapshot are stale after restore
+        register_after_restore(warm_up_bedrock_connection)
 
-def create_response(status_code: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+
+def create_response(
+    status_code: int,
+    body: Dict[str, Any],
+    headers: Optional[Dict[str, str]] = None,
+    request_headers: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
     """
     Create a standardized API Gateway response.
     
@@ -38,28 +153,136 @@ def create_response(status_code: int, body: Dict[str, Any], headers: Optional[Di
         status_code: HTTP status code
         body: Response body as dictionary
         headers: Optional HTTP headers
+        request_headers: Optional request headers, used to negotiate gzip encoding
         
     Returns:
         Dict containing the formatted API Gateway response
     """
-    default_headers = {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization'
-    }
-    
+    # The runtime JSON-encodes the result, so always hand back a plain dict
     if headers:
-        default_headers.update(headers)
+        response_headers = {**_DEFAULT_HEADERS, **headers}
+    else:
+        response_headers = dict(_DEFAULT_HEADERS)
+    
+    body_str = _dumps(body)
+    
+    if request_headers is None:
+        return {
+            'statusCode': status_code,
+            'headers': response_headers,
+            'body': body_str
+        }
+    
+    # The encoding depends on Accept-Encoding, so shared caches must key on it
+    response_headers['Vary'] = 'Accept-Encoding'
+    
+    if len(body_str) >= COMPRESS_MIN and accepts_gzip(request_headers):
+        # API Gateway expects binary bodies to be base64 encoded
+        compressed = gzip.compress(body_str.encode('utf-8'), compresslevel=1)
+        response_headers['Content-Encoding'] = 'gzip'
+        return {
+            'statusCode': status_code,
+            'headers': response_headers,
+            'body': base64.b64encode(compressed).decode('ascii'),
+            'isBase64Encoded': True
+        }
     
     return {
         'statusCode': status_code,
-        'headers': default_headers,
-        'body': json.dumps(body)
+        'headers': response_headers,
+        'body': body_str
     }
 
 
-def validate_request(event: Dict[str, Any]) -> Optional[str]:
+def accepts_gzip(request_headers: Dict[str, str]) -> bool:
+    """
+    Check whether the client advertised gzip support.
+    
+    Args:
+        request_headers: Request headers from the API Gateway event
+        
+    Returns:
+        True if the Accept-Encoding header lists gzip with a non-zero quality
+    """
+    for name, value in request_headers.items():
+        if name.lower() != 'accept-encoding' or not value:
+            continue
+        
+        for coding in value.split(','):
+            coding_name, _, params = coding.partition(';')
+            if coding_name.strip().lower() != 'gzip':
+                continue
+            
+            # gzip;q=0 means the client refuses gzip
+            for param in params.split(';'):
+                param_name, _, param_value = param.partition('=')
+                if param_name.strip().lower() == 'q':
+                    try:
+                        return float(param_value) > 0
+                    except ValueError:
+                        return False
+            return True
+    return False
+
+
+# Preflight responses never vary, so serialize the body once
+_CORS_PREFLIGHT_BODY = _dumps({'message': 'CORS preflight successful'})
+
+
+def get_cache_key(prompt: str) -> bytes:
+    """
+    Build the response cache key for a prompt.
+    
+    Args:
+        prompt: User input prompt
+        
+    Returns:
+        Digest of the normalized prompt
+    """
+    return hashlib.blake2b(prompt.strip().lower().encode('utf-8'), digest_size=16).digest()
+
+
+def get_cached_response(key: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Look up a previously generated Bedrock response.
+    
+    Args:
+        key: Cache key from get_cache_key
+        
+    Returns:
+        The cached Bedrock response, or None if missing or expired
+    """
+    entry = _RESPONSE_CACHE.get(key)
+    if entry is None:
+        return None
+    
+    expires_at, value = entry
+    if expires_at <= time.monotonic():
+        del _RESPONSE_CACHE[key]
+        return None
+    
+    _RESPONSE_CACHE.move_to_end(key)
+    return value
+
+
+def put_cached_response(key: bytes, value: Dict[str, Any]) -> None:
+    """
+    Store a Bedrock response, evicting the least recently used entries when full.
+    
+    Args:
+        key: Cache key from get_cache_key
+        value: Successful Bedrock response to cache
+    """
+    if CACHE_MAX <= 0:
+        return
+    
+    _RESPONSE_CACHE[key] = (time.monotonic() + CACHE_TTL, value)
+    _RESPONSE_CACHE.move_to_end(key)
+    while len(_RESPONSE_CACHE) > CACHE_MAX:
+        _RESPONSE_CACHE.popitem(last=False)
+
+
+def validate_request(event: Dict[str, Any]) -> Tuple[Optional[str], Optional[str], Optional[List[str]]]:
     """
     Validate the incoming request structure and content.
     
@@ -67,38 +290,129 @@ def validate_request(event: Dict[str, Any]) -> Optional[str]:
         event: Lambda event dictionary
         
     Returns:
-        Error message if validation fails, None if valid
+        Tuple of (error message, stripped prompt, stripped batch prompts). On
+        success the error message is None and exactly one of prompt or prompts
+        is set.
     """
     try:
         # Check if body exists
-        if 'body' not in event or not event['body']:
-            return "Request body is required"
+        raw_body = event.get('body')
+        if not raw_body:
+            return "Request body is required", None, None
+        
+        # Reject oversized payloads before paying to decode or parse them;
+        # base64 encoding inflates the body by a factor of 4/3
+        is_base64 = event.get('isBase64Encoded')
+        max_length = (MAX_BODY_LENGTH + 2) // 3 * 4 if is_base64 else MAX_BODY_LENGTH
+        if len(raw_body) > max_length:
+            return "Request body too large", None, None
+        
+        # API Gateway base64-encodes bodies of binary media types
+        if is_base64:
+            raw_body = base64.b64decode(raw_body)
         
         # Parse JSON body
         try:
-            body = json.loads(event['body'])
+            body = _loads(raw_body)
         except json.JSONDecodeError:
-            return "Invalid JSON in request body"
+            return "Invalid JSON in request body", None, None
         
-        # Check if prompt exists and is valid
-        if 'prompt' not in body:
-            return "Missing 'prompt' field in request body"
+        # A JSON array or scalar cannot carry a prompt field
+        if not isinstance(body, dict):
+            return "Missing 'prompt' field in request body", None, None
         
-        prompt = body['prompt']
-        if not isinstance(prompt, str):
-            return "Prompt must be a string"
+        prompt = body.get('prompt')
         
-        if not prompt.strip():
-            return "Prompt cannot be empty"
+        # Batch requests carry a list of prompts instead of a single prompt
+        prompts = body.get('prompts') if prompt is None else None
+        if prompts is not None:
+            if not isinstance(prompts, list) or not prompts:
+                return "'prompts' must be a non-empty list", None, None
+            
+            if len(prompts) > MAX_BATCH_PROMPTS:
+                return f"'prompts' exceeds maximum of {MAX_BATCH_PROMPTS} prompts", None, None
+            
+            stripped_prompts = []
+            for batch_prompt in prompts:
+                error, stripped = validate_prompt(batch_prompt)
+                if error:
+                    return error, None, None
+                stripped_prompts.append(stripped)
+            
+            return None, None, stripped_prompts
         
-        if len(prompt) > 4000:
-            return "Prompt exceeds maximum length of 4000 characters"
+        # Check if prompt exists and is valid
+        if prompt is None:
+            return "Missing 'prompt' field in request body", None, None
         
-        return None
+        error, stripped = validate_prompt(prompt)
+        if error:
+            return error, None, None
+        
+        return None, stripped, None
         
     except Exception as e:
         logger.error(f"Validation error: {str(e)}")
-        return "Invalid request format"
+        return "Invalid request format", None, None
+
+
+def validate_prompt(prompt: Any) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Validate a single prompt value.
+    
+    Args:
+        prompt: Prompt value from the request body
+        
+    Returns:
+        Tuple of (error message, stripped prompt). The error message is None
+        when the prompt is valid.
+    """
+    if not isinstance(prompt, str):
+        return "Prompt must be a string", None
+    
+    # Reject oversized prompts before copying them with strip()
+    if len(prompt) > 4000:
+        return "Prompt exceeds maximum length of 4000 characters", None
+    
+    stripped = prompt.strip()
+    if not stripped:
+        return "Prompt cannot be empty", None
+    
+    return None, stripped
+
+
+def build_converse_request(prompt: str) -> Dict[str, Any]:
+    """
+    Build the Converse API parameters for the given prompt.
+    
+    Args:
+        prompt: User input prompt
+        
+    Returns:
+        Keyword arguments for converse
+    """
+    request = {
+        'modelId': BEDROCK_MODEL_ID,
+        'messages': [
+            {
+                'role': 'user',
+                'content': [{'text': prompt}]
+            }
+        ],
+        'inferenceConfig': {
+            'maxTokens': MAX_TOKENS,
+            'temperature': TEMPERATURE
+        }
+    }
+    
+    # Mark the stable system prompt as a cache point so Bedrock can reuse the prefix
+    if SYSTEM_PROMPT:
+        request['system'] = [
+            {'text': SYSTEM_PROMPT},
+            {'cachePoint': {'type': 'default'}}
+        ]
+    
+    return request
 
 
 def invoke_bedrock_model(prompt: str) -> Dict[str, Any]:
@@ -115,42 +429,28 @@ def invoke_bedrock_model(prompt: str) -> Dict[str, Any]:
         ClientError: If there's an AWS service error
         Exception: For other unexpected errors
     """
+    model_id = BEDROCK_MODEL_ID
+    
     try:
-        # Prepare the request body for Claude 3.5 Haiku
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": MAX_TOKENS,
-            "temperature": TEMPERATURE,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        }
-        
-        logger.info(f"Invoking Bedrock model: {BEDROCK_MODEL_ID}")
-        
-        # Invoke the model
-        response = bedrock_client.invoke_model(
-            modelId=BEDROCK_MODEL_ID,
-            body=json.dumps(request_body),
-            contentType='application/json',
-            accept='application/json'
-        )
-        
-        # Parse the response
-        response_body = json.loads(response['body'].read())
+        # Invoke the model; boto3 returns the parsed response
+        response = bedrock_client.converse(**build_converse_request(prompt))
         
         # Extract the generated text
-        if 'content' in response_body and len(response_body['content']) > 0:
-            generated_text = response_body['content'][0]['text']
+        content = response.get('output', {}).get('message', {}).get('content', [])
+        if content and 'text' in content[0]:
+            generated_text = content[0]['text']
+            usage = response.get('usage', {})
             
             return {
                 'success': True,
                 'response': generated_text,
-                'model_id': BEDROCK_MODEL_ID,
-                'usage': response_body.get('usage', {})
+                'model_id': model_id,
+                'usage': {
+                    'input_tokens': usage.get('inputTokens', 0),
+                    'output_tokens': usage.get('outputTokens', 0),
+                    'cache_read_input_tokens': usage.get('cacheReadInputTokens', 0),
+                    'cache_creation_input_tokens': usage.get('cacheWriteInputTokens', 0)
+                }
             }
         else:
             logger.error("Unexpected response format from Bedrock")
@@ -164,26 +464,10 @@ def invoke_bedrock_model(prompt: str) -> Dict[str, Any]:
         error_message = e.response['Error']['Message']
         logger.error(f"Bedrock ClientError: {error_code} - {error_message}")
         
-        if error_code == 'AccessDeniedException':
-            return {
-                'success': False,
-                'error': 'Access denied to Bedrock model. Please check IAM permissions.'
-            }
-        elif error_code == 'ValidationException':
-            return {
-                'success': False,
-                'error': 'Invalid request to Bedrock model.'
-            }
-        elif error_code == 'ThrottlingException':
-            return {
-                'success': False,
-                'error': 'Request throttled. Please try again later.'
-            }
-        else:
-            return {
-                'success': False,
-                'error': f'Bedrock service error: {error_message}'
-            }
+        return {
+            'success': False,
+            'error': _ERROR_MAP.get(error_code) or f'Bedrock service error: {error_message}'
+        }
             
     except BotoCoreError as e:
         logger.error(f"BotoCoreError: {str(e)}")
@@ -200,6 +484,20 @@ def invoke_bedrock_model(prompt: str) -> Dict[str, Any]:
         }
 
 
+def invoke_bedrock_model_batch(prompts: List[str]) -> List[Dict[str, Any]]:
+    """
+    Invoke the Bedrock model for several prompts concurrently.
+    
+    Args:
+        prompts: User input prompts
+        
+    Returns:
+        List of invoke_bedrock_model results in the same order as the prompts
+    """
+    with ThreadPoolExecutor(max_workers=min(len(prompts), MAX_BATCH_PROMPTS)) as executor:
+        return list(executor.map(invoke_bedrock_model, prompts))
+
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Main Lambda handler function for processing Bedrock requests.
@@ -215,14 +513,19 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         Dict containing the API Gateway response
     """
     try:
-        logger.info(f"Received event: {json.dumps(event, default=str)}")
-        
         # Handle CORS preflight requests
         if event.get('httpMethod') == 'OPTIONS':
-            return create_response(200, {'message': 'CORS preflight successful'})
+            return {
+                'statusCode': 200,
+                'headers': dict(_DEFAULT_HEADERS),
+                'body': _CORS_PREFLIGHT_BODY
+            }
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received event: %s", json.dumps(event, default=str))
         
         # Validate the request
-        validation_error = validate_request(event)
+        validation_error, prompt, prompts = validate_request(event)
         if validation_error:
             logger.warning(f"Request validation failed: {validation_error}")
             return create_response(400, {
@@ -230,23 +533,43 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'message': validation_error
             })
         
-        # Extract the prompt from the request
-        body = json.loads(event['body'])
-        prompt = body['prompt'].strip()
+        # Batch requests return one result per prompt, in request order
+        if prompts is not None:
+            logger.info("Processing batch of %d prompts", len(prompts))
+            return create_response(200, {
+                'message': 'Success',
+                'responses': invoke_bedrock_model_batch(prompts)
+            }, request_headers=event.get('headers') or {})
         
-        logger.info(f"Processing prompt of length: {len(prompt)}")
+        logger.info("Processing prompt of length: %d", len(prompt))
         
-        # Invoke the Bedrock model
-        bedrock_response = invoke_bedrock_model(prompt)
+        # Serve identical prompts from the warm container's cache
+        cache_key = get_cache_key(prompt)
+        bedrock_response = get_cached_response(cache_key)
+        cache_hit = bedrock_response is not None
+        
+        if cache_hit:
+            logger.info("Serving response from cache")
+        else:
+            # Invoke the Bedrock model
+            bedrock_response = invoke_bedrock_model(prompt)
+            if bedrock_response['success']:
+                put_cached_response(cache_key, bedrock_response)
         
         if bedrock_response['success']:
             logger.info("Successfully generated response from Bedrock")
+            usage = bedrock_response.get('usage', {})
+            if cache_hit:
+                # No tokens were consumed; don't report the original call's usage again
+                usage = {key: 0 for key in usage}
+            
             return create_response(200, {
                 'message': 'Success',
                 'response': bedrock_response['response'],
                 'model_id': bedrock_response['model_id'],
-                'usage': bedrock_response.get('usage', {})
-            })
+                'usage': usage,
+                'cache_hit': cache_hit
+            }, request_headers=event.get('headers') or {})
         else:
             logger.error(f"Bedrock invocation failed: {bedrock_response['error']}")
             return create_response(500, {
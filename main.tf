@@ -89,6 +89,9 @@ resource "aws_lambda_function" "bedrock_lambda" {
   environment {
     variables = {
       BEDROCK_MODEL_ID = var.bedrock_model_id
+      SYSTEM_PROMPT    = var.system_prompt
+      LOG_LEVEL        = var.log_level
+      WARMUP_BEDROCK   = var.warmup_bedrock ? "1" : "0"
     }
   }
 
@@ -107,6 +110,9 @@ resource "aws_api_gateway_rest_api" "bedrock_api" {
   name        = "${var.project_name}-api"
   description = "API Gateway for Bedrock GenAI Microservice"
 
+  # Lets the Lambda return gzip-compressed (base64-encoded) response bodies
+  binary_media_types = ["*/*"]
+
   endpoint_configuration {
     types = ["REGIONAL"]
   }
@@ -159,8 +165,22 @@ resource "aws_api_gateway_model" "bedrock_request_model" {
         maxLength   = 4000
         description = "The user input prompt for the AI model"
       }
+      prompts = {
+        type     = "array"
+        minItems = 1
+        maxItems = 16
+        items = {
+          type      = "string"
+          minLength = 1
+          maxLength = 4000
+        }
+        description = "A batch of prompts processed in parallel"
+      }
     }
-    required = ["prompt"]
+    oneOf = [
+      { required = ["prompt"] },
+      { required = ["prompts"] }
+    ]
   })
 }
 
@@ -8,9 +8,11 @@ Author: Development Team
 Project: GenAI Bedrock Microservice
 """
 
+import base64
+import gzip
 import json
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch
 from botocore.exceptions import ClientError, BotoCoreError
 
 # Import the Lambda function module
@@ -18,14 +20,25 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lambda'))
 
+import lambda_function
 from lambda_function import (
     lambda_handler,
     create_response,
     validate_request,
-    invoke_bedrock_model
+    invoke_bedrock_model,
+    invoke_bedrock_model_batch,
+    warm_up_bedrock_connection
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Start every test with an empty response cache."""
+    lambda_function._RESPONSE_CACHE.clear()
+    yield
+    lambda_function._RESPONSE_CACHE.clear()
+
+
 class TestCreateResponse:
     """Test cases for the create_response function."""
     
@@ -35,6 +48,7 @@ class TestCreateResponse:
         
         assert response['statusCode'] == 200
         assert 'headers' in response
+        assert 'Vary' not in response['headers']
         assert response['headers']['Content-Type'] == 'application/json'
         assert response['headers']['Access-Control-Allow-Origin'] == '*'
         
@@ -49,6 +63,38 @@ class TestCreateResponse:
         assert response['statusCode'] == 201
         assert response['headers']['X-Custom-Header'] == 'test-value'
         assert response['headers']['Content-Type'] == 'application/json'
+    
+    def test_create_response_gzip(self):
+        """Test that large responses are gzipped when the client accepts it."""
+        body = {'response': 'x' * 2048}
+        response = create_response(200, body, request_headers={'Accept-Encoding': 'gzip, deflate'})
+        
+        assert response['isBase64Encoded'] is True
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        assert response['headers']['Vary'] == 'Accept-Encoding'
+        assert json.loads(gzip.decompress(base64.b64decode(response['body']))) == body
+    
+    def test_create_response_no_gzip_for_small_body(self):
+        """Test that small responses are returned uncompressed."""
+        response = create_response(200, {'message': 'success'}, request_headers={'accept-encoding': 'gzip'})
+        
+        assert 'isBase64Encoded' not in response
+        assert 'Content-Encoding' not in response['headers']
+        assert response['headers']['Vary'] == 'Accept-Encoding'
+        assert json.loads(response['body'])['message'] == 'success'
+    
+    @pytest.mark.parametrize('accept_encoding, compressed', [
+        ('gzip;q=0', False),
+        ('deflate, gzip; q=0.0', False),
+        ('br, gzip;q=0.5', True),
+        ('deflate', False)
+    ])
+    def test_create_response_gzip_quality(self, accept_encoding, compressed):
+        """Test that Accept-Encoding quality values are respected."""
+        response = create_response(200, {'response': 'x' * 2048}, request_headers={'Accept-Encoding': accept_encoding})
+        
+        assert response.get('isBase64Encoded', False) is compressed
+        assert ('Content-Encoding' in response['headers']) is compressed
 
 
 class TestValidateRequest:
@@ -57,93 +103,193 @@ class TestValidateRequest:
     def test_validate_request_valid(self):
         """Test validation with valid request."""
         event = {
-            'body': json.dumps({'prompt': 'Hello, how are you?'})
+            'body': json.dumps({'prompt': '  Hello, how are you?\n'})
         }
         
-        result = validate_request(event)
-        assert result is None
+        error, prompt, prompts = validate_request(event)
+        assert error is None
+        assert prompts is None
+        assert prompt == 'Hello, how are you?'
     
     def test_validate_request_missing_body(self):
         """Test validation with missing body."""
         event = {}
         
-        result = validate_request(event)
-        assert result == "Request body is required"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Request body is required"
     
     def test_validate_request_empty_body(self):
         """Test validation with empty body."""
         event = {'body': ''}
         
-        result = validate_request(event)
-        assert result == "Request body is required"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Request body is required"
     
     def test_validate_request_invalid_json(self):
         """Test validation with invalid JSON."""
         event = {'body': 'invalid json'}
         
-        result = validate_request(event)
-        assert result == "Invalid JSON in request body"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Invalid JSON in request body"
     
     def test_validate_request_missing_prompt(self):
         """Test validation with missing prompt field."""
         event = {'body': json.dumps({'message': 'hello'})}
         
-        result = validate_request(event)
-        assert result == "Missing 'prompt' field in request body"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Missing 'prompt' field in request body"
+    
+    @pytest.mark.parametrize('raw_body', ['[1, 2]', '"hi"', '42'])
+    def test_validate_request_non_object_body(self, raw_body):
+        """Test validation with a JSON body that is not an object."""
+        event = {'body': raw_body}
+        
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Missing 'prompt' field in request body"
     
     def test_validate_request_non_string_prompt(self):
         """Test validation with non-string prompt."""
         event = {'body': json.dumps({'prompt': 123})}
         
-        result = validate_request(event)
-        assert result == "Prompt must be a string"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Prompt must be a string"
     
     def test_validate_request_empty_prompt(self):
         """Test validation with empty prompt."""
         event = {'body': json.dumps({'prompt': '   '})}
         
-        result = validate_request(event)
-        assert result == "Prompt cannot be empty"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Prompt cannot be empty"
     
     def test_validate_request_long_prompt(self):
         """Test validation with overly long prompt."""
         long_prompt = 'a' * 4001
         event = {'body': json.dumps({'prompt': long_prompt})}
         
-        result = validate_request(event)
-        assert result == "Prompt exceeds maximum length of 4000 characters"
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Prompt exceeds maximum length of 4000 characters"
+    
+    def test_validate_request_base64_body(self):
+        """Test validation with a base64-encoded body from API Gateway."""
+        event = {
+            'body': base64.b64encode(json.dumps({'prompt': 'Hello'}).encode('utf-8')).decode('ascii'),
+            'isBase64Encoded': True
+        }
+        
+        error, prompt, prompts = validate_request(event)
+        assert error is None
+        assert prompts is None
+        assert prompt == 'Hello'
+    
+    @patch('lambda_function.MAX_BODY_LENGTH', 8192)
+    @patch('lambda_function._loads')
+    def test_validate_request_oversize_body(self, mock_loads):
+        """Test that an oversized body is rejected without being parsed."""
+        event = {'body': json.dumps({'prompt': 'a' * 10000})}
+        
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Request body too large"
+        mock_loads.assert_not_called()
+    
+    @pytest.mark.parametrize('char', ['\u8a9e', '\U0001f600'])
+    def test_validate_request_maximal_non_ascii_batch(self, char):
+        """Test that a full batch of maximum-length non-ASCII prompts is accepted."""
+        raw_body = json.dumps({'prompts': [char * 4000] * 16})
+        
+        error, prompt, prompts = validate_request({'body': raw_body})
+        assert error is None
+        assert len(prompts) == 16
+        
+        encoded_body = base64.b64encode(raw_body.encode('utf-8')).decode('ascii')
+        error, prompt, prompts = validate_request({'body': encoded_body, 'isBase64Encoded': True})
+        assert error is None
+        assert len(prompts) == 16
+        
+        utf8_body = base64.b64encode(json.dumps({'prompts': [char * 4000] * 16}, ensure_ascii=False).encode('utf-8'))
+        error, prompt, prompts = validate_request({'body': utf8_body.decode('ascii'), 'isBase64Encoded': True})
+        assert error is None
+        assert len(prompts) == 16
+    
+    def test_validate_request_valid_batch(self):
+        """Test validation with a valid list of prompts."""
+        event = {'body': json.dumps({'prompts': ['Hello', '  How are you? ']})}
+        
+        error, prompt, prompts = validate_request(event)
+        assert error is None
+        assert prompt is None
+        assert prompts == ['Hello', 'How are you?']
+    
+    def test_validate_request_too_many_prompts(self):
+        """Test validation with more prompts than a batch allows."""
+        event = {'body': json.dumps({'prompts': ['Hello'] * 17})}
+        
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "'prompts' exceeds maximum of 16 prompts"
+    
+    def test_validate_request_invalid_prompt_in_batch(self):
+        """Test validation with an invalid entry in the prompts list."""
+        event = {'body': json.dumps({'prompts': ['Hello', '   ']})}
+        
+        error, prompt, prompts = validate_request(event)
+        assert prompt is None and prompts is None
+        assert error == "Prompt cannot be empty"
 
 
 class TestInvokeBedrockModel:
     """Test cases for the invoke_bedrock_model function."""
     
+    @patch('lambda_function.SYSTEM_PROMPT', 'You are a helpful assistant.')
     @patch('lambda_function.bedrock_client')
     def test_invoke_bedrock_model_success(self, mock_bedrock_client):
         """Test successful Bedrock model invocation."""
-        # Mock successful response
-        mock_response = {
-            'body': MagicMock()
+        # Mock successful Converse response
+        mock_bedrock_client.converse.return_value = {
+            'output': {
+                'message': {
+                    'role': 'assistant',
+                    'content': [{'text': 'Hello! How can I help you today?'}]
+                }
+            },
+            'usage': {'inputTokens': 10, 'outputTokens': 15, 'totalTokens': 25, 'cacheReadInputTokens': 8}
         }
-        mock_response['body'].read.return_value = json.dumps({
-            'content': [{'text': 'Hello! How can I help you today?'}],
-            'usage': {'input_tokens': 10, 'output_tokens': 15}
-        }).encode('utf-8')
-        
-        mock_bedrock_client.invoke_model.return_value = mock_response
         
         result = invoke_bedrock_model("Hello")
         
         assert result['success'] is True
         assert result['response'] == 'Hello! How can I help you today?'
-        assert 'usage' in result
+        assert result['usage'] == {
+            'input_tokens': 10,
+            'output_tokens': 15,
+            'cache_read_input_tokens': 8,
+            'cache_creation_input_tokens': 0
+        }
         assert result['model_id'] == 'anthropic.claude-3-5-haiku-20241022-v1:0'
+        
+        # The system prompt should be sent with a cache point after it
+        request = mock_bedrock_client.converse.call_args.kwargs
+        assert request['messages'] == [{'role': 'user', 'content': [{'text': 'Hello'}]}]
+        assert request['inferenceConfig'] == {'maxTokens': 4000, 'temperature': 0.7}
+        assert request['system'] == [
+            {'text': 'You are a helpful assistant.'},
+            {'cachePoint': {'type': 'default'}}
+        ]
     
     @patch('lambda_function.bedrock_client')
     def test_invoke_bedrock_model_access_denied(self, mock_bedrock_client):
         """Test Bedrock model invocation with access denied error."""
-        mock_bedrock_client.invoke_model.side_effect = ClientError(
+        mock_bedrock_client.converse.side_effect = ClientError(
             error_response={'Error': {'Code': 'AccessDeniedException', 'Message': 'Access denied'}},
-            operation_name='InvokeModel'
+            operation_name='Converse'
         )
         
         result = invoke_bedrock_model("Hello")
@@ -154,9 +300,9 @@ class TestInvokeBedrockModel:
     @patch('lambda_function.bedrock_client')
     def test_invoke_bedrock_model_throttling(self, mock_bedrock_client):
         """Test Bedrock model invocation with throttling error."""
-        mock_bedrock_client.invoke_model.side_effect = ClientError(
+        mock_bedrock_client.converse.side_effect = ClientError(
             error_response={'Error': {'Code': 'ThrottlingException', 'Message': 'Request throttled'}},
-            operation_name='InvokeModel'
+            operation_name='Converse'
         )
         
         result = invoke_bedrock_model("Hello")
@@ -167,9 +313,9 @@ class TestInvokeBedrockModel:
     @patch('lambda_function.bedrock_client')
     def test_invoke_bedrock_model_validation_error(self, mock_bedrock_client):
         """Test Bedrock model invocation with validation error."""
-        mock_bedrock_client.invoke_model.side_effect = ClientError(
+        mock_bedrock_client.converse.side_effect = ClientError(
             error_response={'Error': {'Code': 'ValidationException', 'Message': 'Invalid request'}},
-            operation_name='InvokeModel'
+            operation_name='Converse'
         )
         
         result = invoke_bedrock_model("Hello")
@@ -180,7 +326,7 @@ class TestInvokeBedrockModel:
     @patch('lambda_function.bedrock_client')
     def test_invoke_bedrock_model_botocore_error(self, mock_bedrock_client):
         """Test Bedrock model invocation with BotoCoreError."""
-        mock_bedrock_client.invoke_model.side_effect = BotoCoreError()
+        mock_bedrock_client.converse.side_effect = BotoCoreError()
         
         result = invoke_bedrock_model("Hello")
         
@@ -190,19 +336,41 @@ class TestInvokeBedrockModel:
     @patch('lambda_function.bedrock_client')
     def test_invoke_bedrock_model_unexpected_response_format(self, mock_bedrock_client):
         """Test Bedrock model invocation with unexpected response format."""
-        mock_response = {
-            'body': MagicMock()
-        }
-        mock_response['body'].read.return_value = json.dumps({
+        mock_bedrock_client.converse.return_value = {
             'unexpected_field': 'value'
-        }).encode('utf-8')
-        
-        mock_bedrock_client.invoke_model.return_value = mock_response
+        }
         
         result = invoke_bedrock_model("Hello")
         
         assert result['success'] is False
         assert 'Unexpected response format' in result['error']
+    
+    @patch('lambda_function.boto3.client')
+    @patch('lambda_function.bedrock_client')
+    def test_warm_up_bedrock_connection_ignores_rejection(self, mock_bedrock_client, mock_boto3_client):
+        """Test that the warm-up makes a single attempt and swallows the expected rejection."""
+        mock_warmup_client = mock_boto3_client.return_value
+        mock_warmup_client.invoke_model.side_effect = ClientError(
+            error_response={'Error': {'Code': 'ValidationException', 'Message': 'Malformed input request'}},
+            operation_name='InvokeModel'
+        )
+        
+        warm_up_bedrock_connection()
+        
+        mock_warmup_client.invoke_model.assert_called_once()
+        mock_bedrock_client.invoke_model.assert_not_called()
+        config = mock_boto3_client.call_args.kwargs['config']
+        assert config.retries['total_max_attempts'] == 1
+        assert mock_warmup_client._endpoint.http_session is mock_bedrock_client._endpoint.http_session
+    
+    @patch('lambda_function.invoke_bedrock_model')
+    def test_invoke_bedrock_model_batch_preserves_order(self, mock_invoke_bedrock):
+        """Test that batch results are returned in prompt order."""
+        mock_invoke_bedrock.side_effect = lambda prompt: {'success': True, 'response': prompt.upper()}
+        
+        results = invoke_bedrock_model_batch(['a', 'b', 'c'])
+        
+        assert [result['response'] for result in results] == ['A', 'B', 'C']
 
 
 class TestLambdaHandler:
@@ -219,6 +387,18 @@ class TestLambdaHandler:
         body = json.loads(response['body'])
         assert body['message'] == 'CORS preflight successful'
     
+    def test_lambda_handler_options_request_not_shared(self):
+        """Test that changing one preflight response does not affect the next."""
+        event = {'httpMethod': 'OPTIONS'}
+        
+        first = lambda_handler(event, Mock())
+        first['headers']['X-Custom-Header'] = 'test-value'
+        first['statusCode'] = 204
+        second = lambda_handler(event, Mock())
+        
+        assert second['statusCode'] == 200
+        assert 'X-Custom-Header' not in second['headers']
+    
     def test_lambda_handler_invalid_request(self):
         """Test handler with invalid request."""
         event = {'body': 'invalid json'}
@@ -254,6 +434,33 @@ class TestLambdaHandler:
         assert body['message'] == 'Success'
         assert body['response'] == 'Hello! How can I help you?'
         assert 'usage' in body
+        assert body['cache_hit'] is False
+    
+    @patch('lambda_function.bedrock_client')
+    def test_lambda_handler_cache_hit(self, mock_bedrock_client):
+        """Test that an identical prompt is served from cache without calling Bedrock."""
+        mock_bedrock_client.converse.return_value = {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': 'Hello! How can I help you?'}]}},
+            'usage': {'inputTokens': 5, 'outputTokens': 10, 'totalTokens': 15}
+        }
+        
+        context = Mock()
+        first = lambda_handler({'httpMethod': 'POST', 'body': json.dumps({'prompt': 'Hello'})}, context)
+        second = lambda_handler({'httpMethod': 'POST', 'body': json.dumps({'prompt': '  hello '})}, context)
+        
+        assert mock_bedrock_client.converse.call_count == 1
+        assert json.loads(first['body'])['cache_hit'] is False
+        body = json.loads(second['body'])
+        assert second['statusCode'] == 200
+        assert body['cache_hit'] is True
+        assert body['response'] == 'Hello! How can I help you?'
+        assert json.loads(first['body'])['usage']['input_tokens'] == 5
+        assert body['usage'] == {
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'cache_creation_input_tokens': 0
+        }
     
     @patch('lambda_function.invoke_bedrock_model')
     def test_lambda_handler_bedrock_failure(self, mock_invoke_bedrock):
@@ -277,6 +484,50 @@ class TestLambdaHandler:
         assert body['error'] == 'Internal Server Error'
         assert 'Access denied' in body['message']
     
+    @patch('lambda_function.invoke_bedrock_model')
+    def test_lambda_handler_batch(self, mock_invoke_bedrock):
+        """Test a batch request returns one result per prompt."""
+        mock_invoke_bedrock.side_effect = [
+            {'success': True, 'response': 'First', 'model_id': 'model', 'usage': {}},
+            {'success': False, 'error': 'Request throttled. Please try again later.'}
+        ]
+        
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'prompts': ['One', 'Two']})
+        }
+        
+        response = lambda_handler(event, Mock())
+        
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['responses'][0]['response'] == 'First'
+        assert body['responses'][1]['success'] is False
+    
+    @patch('lambda_function.invoke_bedrock_model')
+    def test_lambda_handler_ignores_internal_keys_in_body(self, mock_invoke_bedrock):
+        """Test that client-sent keys cannot select the batch path or bypass validation."""
+        mock_invoke_bedrock.return_value = {
+            'success': True,
+            'response': 'Hi!',
+            'model_id': 'anthropic.claude-3-5-haiku-20241022-v1:0',
+            'usage': {}
+        }
+        
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'prompt': 'hi', '_prompts_stripped': ['a' * 5000] * 20})
+        }
+        
+        response = lambda_handler(event, Mock())
+        
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert 'responses' not in body
+        assert body['response'] == 'Hi!'
+        mock_invoke_bedrock.assert_called_once()
+        assert mock_invoke_bedrock.call_args.args[0] == 'hi'
+    
     def test_lambda_handler_json_decode_error(self):
         """Test handler with JSON decode error in main function."""
         event = {
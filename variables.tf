@@ -16,12 +16,30 @@ variable "bedrock_model_id" {
   default     = "anthropic.claude-3-5-haiku-20241022-v1:0"
 }
 
+variable "system_prompt" {
+  description = "Optional system prompt sent with every request and cached by Bedrock"
+  type        = string
+  default     = ""
+}
+
+variable "warmup_bedrock" {
+  description = "Open the Bedrock connection during Lambda init instead of on the first request"
+  type        = bool
+  default     = false
+}
+
 variable "api_stage_name" {
   description = "API Gateway stage name"
   type        = string
   default     = "prod"
 }
 
+variable "log_level" {
+  description = "Python logging level for the Lambda function"
+  type        = string
+  default     = "WARNING"
+}
+
 variable "log_retention_days" {
   description = "CloudWatch log retention period in days"
   type        = number